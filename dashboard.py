@@ -1,3 +1,5 @@
+import io
+
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -9,33 +11,115 @@ st.set_page_config(page_title="Obie Premium Reconciliation", layout="wide")
 
 # Data Loading
 
+# Low-cardinality text columns, held as categoricals so filters and groupbys run on codes
+CATEGORY_COLUMNS = ["state", "table_name", "check_name", "flag_reason"]
+
+def read_table(stem):
+    """Read a table from Parquet if present and current, else CSV (raises FileNotFoundError if neither).
+    
+    The Parquet copy is written after its CSV, so it is used only when it is at least as
+    new; a CSV that lands on its own is never shadowed by a stale copy.
+    """
+    parquet_path = Path(f"{stem}.parquet")
+    csv_path = Path(f"{stem}.csv")
+    if parquet_path.exists() and (
+        not csv_path.exists() or parquet_path.stat().st_mtime_ns >= csv_path.stat().st_mtime_ns
+    ):
+        df = pd.read_parquet(parquet_path, engine="pyarrow")
+    else:
+        df = pd.read_csv(csv_path, engine="pyarrow")
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
 @st.cache_data
 def load_data():
-    """Load all CSV files with error handling."""
+    """Load all output tables with error handling."""
     try:
-        dq_issues = pd.read_csv("output/data_quality_issues.csv")
+        dq_issues = read_table("output/data_quality_issues")
     except FileNotFoundError:
         dq_issues = pd.DataFrame(columns=["table_name", "check_name", "policy_id", "issue_detail"])
     
     try:
-        reconciliation = pd.read_csv("output/reconciliation_results.csv")
+        dq_summary = read_table("output/dq_summary")
+    except FileNotFoundError:
+        # Older outputs hold every failing row, so count them directly
+        dq_summary = dq_issues.groupby(["table_name", "check_name"], observed=True).size().rename("issue_count").reset_index()
+    
+    try:
+        reconciliation = read_table("output/reconciliation_results")
     except FileNotFoundError:
         reconciliation = pd.DataFrame(columns=["policy_id", "premium_policy", "premium_gl", "diff", "diff_pct", "flag_reason"])
     
     try:
-        reporting = pd.read_csv("output/reporting_dataset.csv")
-        # Convert booking_date to datetime for proper sorting
-        if "booking_date" in reporting.columns:
-            reporting["booking_date"] = pd.to_datetime(reporting["booking_date"])
+        reporting = read_table("output/reporting_dataset")
+        # Convert booking_date to datetime for proper sorting (Parquet outputs are already typed)
+        if "booking_date" in reporting.columns and not pd.api.types.is_datetime64_any_dtype(reporting["booking_date"]):
+            reporting["booking_date"] = pd.to_datetime(reporting["booking_date"], format="%Y-%m-%d")
     except FileNotFoundError:
         reporting = pd.DataFrame(columns=["booking_date", "state", "total_policy_premium", "total_gl_premium", "variance"])
     
     try:
-        claims = pd.read_csv("data/claims.csv")
+        claims = read_table("data/claims")
+        # Generated amounts are stored as float32, which only approximates each cent value;
+        # widen and re-round to cents so totals match the CSV to the cent
+        float32_cols = claims.select_dtypes("float32").columns
+        claims[float32_cols] = claims[float32_cols].astype("float64").round(2)
     except FileNotFoundError:
         claims = pd.DataFrame(columns=["state", "incurred_loss", "paid_loss"])
     
-    return dq_issues, reconciliation, reporting, claims
+    # Filter choices are computed here so they run once per cache epoch, not per rerun
+    filter_options = {
+        "table_name": sorted(dq_issues["table_name"].dropna().unique().tolist()),
+        "check_name": sorted(dq_issues["check_name"].dropna().unique().tolist()),
+        "state": sorted(reporting["state"].dropna().unique().tolist()),
+    }
+    
+    # Row positions per reconciliation flag, so the status filter is a lookup rather than a scan
+    recon_by_flag = reconciliation.groupby("flag_reason", observed=True, sort=False).indices
+    
+    return dq_issues, dq_summary, reconciliation, reporting, claims, filter_options, recon_by_flag
+
+@st.cache_data
+def df_to_csv_bytes(df):
+    """Serialize a frame for download once per distinct frame, not on every rerun."""
+    return df.to_csv(index=False).encode("utf-8")
+
+@st.cache_data
+def df_to_parquet_bytes(df):
+    """Parquet counterpart of df_to_csv_bytes for larger downloads."""
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, engine="pyarrow", index=False)
+    return buffer.getvalue()
+
+@st.cache_data
+def reporting_rollups(_reporting, states):
+    """Daily and per-state premium totals for a state selection.
+    
+    The reporting frame is left out of the cache key (leading underscore); it only
+    changes on regeneration, which clears the cache.
+    """
+    selected = _reporting.loc[_reporting["state"].isin(states).to_numpy()] if states else _reporting
+    premium_cols = ["total_policy_premium", "total_gl_premium"]
+    time_series = selected.groupby("booking_date")[premium_cols].sum().reset_index()
+    state_summary = selected.groupby("state", observed=True)[premium_cols].sum().reset_index()
+    return time_series, state_summary
+
+@st.cache_data
+def loss_ratio_by_state(_reporting, _claims):
+    """Incurred and paid losses against written premium per state.
+    
+    Inputs are left out of the cache key like in reporting_rollups; regeneration clears the cache.
+    """
+    state_premiums = _reporting.groupby("state", observed=True)["total_policy_premium"].sum().reset_index()
+    state_claims = _claims.groupby("state", observed=True).agg({
+        "incurred_loss": "sum",
+        "paid_loss": "sum"
+    }).reset_index()
+    state_analysis = state_claims.merge(state_premiums, on="state", how="left")
+    state_analysis["loss_ratio"] = (state_analysis["incurred_loss"] / state_analysis["total_policy_premium"]) * 100
+    return state_analysis
 
 def regenerate_data():
     """Regenerate data by calling backend scripts."""
@@ -56,7 +140,7 @@ def regenerate_data():
 
 
 # Load data
-dq_issues, reconciliation, reporting, claims = load_data()
+dq_issues, dq_summary, reconciliation, reporting, claims, filter_options, recon_by_flag = load_data()
 
 # Header and regenerate button
 col_title, col_button = st.columns([4, 1])
@@ -75,7 +159,7 @@ st.divider()
 total_policy_premium = reconciliation["premium_policy"].sum() if len(reconciliation) > 0 else 0
 total_gl_premium = reconciliation["premium_gl"].sum() if len(reconciliation) > 0 else 0
 delta_premium = total_gl_premium - total_policy_premium
-num_dq_issues = len(dq_issues)
+num_dq_issues = int(dq_summary["issue_count"].sum())
 
 col1, col2, col3 = st.columns(3)
 
@@ -142,13 +226,13 @@ tab1, tab2, tab3, tab4 = st.tabs(["📋 Data Quality", "🔄 Reconciliation", "
 
 with tab1:
     st.subheader("Data Quality Issues")
-    st.caption("Records failing data quality rules")
+    st.caption("Records failing data quality rules (a capped sample per check; counts cover every failing row)")
     
     # Tab-specific filters
     col_f1, col_f2, col_f3 = st.columns(3)
     
     with col_f1:
-        dq_tables = ["All tables"] + sorted(dq_issues["table_name"].dropna().unique().tolist()) if len(dq_issues) > 0 else ["All tables"]
+        dq_tables = ["All tables"] + filter_options["table_name"]
         selected_dq_table = st.selectbox(
             "Filter by Table",
             options=dq_tables,
@@ -156,7 +240,7 @@ with tab1:
         )
     
     with col_f2:
-        dq_checks = ["All checks"] + sorted(dq_issues["check_name"].dropna().unique().tolist()) if len(dq_issues) > 0 else ["All checks"]
+        dq_checks = ["All checks"] + filter_options["check_name"]
         selected_dq_check = st.selectbox(
             "Filter by Check",
             options=dq_checks,
@@ -166,32 +250,40 @@ with tab1:
     with col_f3:
         show_all_rows = st.checkbox("Show all rows", value=False, key="show_all_dq")
     
-    # Apply filters
-    filtered_dq = dq_issues.copy()
+    # Apply filters as one combined mask per frame, sliced once
+    dq_mask = np.ones(len(dq_issues), dtype=bool)
+    dq_summary_mask = np.ones(len(dq_summary), dtype=bool)
     
     if selected_dq_table != "All tables":
-        filtered_dq = filtered_dq[filtered_dq["table_name"] == selected_dq_table]
+        dq_mask &= (dq_issues["table_name"] == selected_dq_table).to_numpy()
+        dq_summary_mask &= (dq_summary["table_name"] == selected_dq_table).to_numpy()
     
     if selected_dq_check != "All checks":
-        filtered_dq = filtered_dq[filtered_dq["check_name"] == selected_dq_check]
+        dq_mask &= (dq_issues["check_name"] == selected_dq_check).to_numpy()
+        dq_summary_mask &= (dq_summary["check_name"] == selected_dq_check).to_numpy()
+    
+    filtered_dq = dq_issues.loc[dq_mask]
+    filtered_dq_summary = dq_summary.loc[dq_summary_mask]
+    
+    total_filtered_issues = int(filtered_dq_summary["issue_count"].sum())
     
     st.divider()
     
     # DQ Summary
-    if len(filtered_dq) > 0:
+    if total_filtered_issues > 0:
         st.write("**📊 Data Quality Summary**")
         
         col1, col2 = st.columns(2)
         
         with col1:
             # Issues by check name
-            check_summary = filtered_dq["check_name"].value_counts().reset_index()
+            check_summary = filtered_dq_summary.groupby("check_name", observed=True)["issue_count"].sum().sort_values(ascending=False).reset_index()
             check_summary.columns = ["Check Name", "Count"]
             st.dataframe(check_summary, use_container_width=True, height=200)
         
         with col2:
             # Issues by table
-            table_summary = filtered_dq["table_name"].value_counts().reset_index()
+            table_summary = filtered_dq_summary.groupby("table_name", observed=True)["issue_count"].sum().sort_values(ascending=False).reset_index()
             table_summary.columns = ["Table Name", "Count"]
             st.dataframe(table_summary, use_container_width=True, height=200)
         
@@ -200,7 +292,7 @@ with tab1:
     # Display metrics
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Issues (Filtered)", len(filtered_dq))
+        st.metric("Total Issues (Filtered)", total_filtered_issues)
     with col2:
         rows_to_show = len(filtered_dq) if show_all_rows else min(200, len(filtered_dq))
         st.metric("Displaying", rows_to_show)
@@ -209,11 +301,18 @@ with tab1:
         if len(filtered_dq) > 0:
             st.download_button(
                 "📥 Download DQ Issues",
-                filtered_dq.to_csv(index=False).encode("utf-8"),
+                df_to_csv_bytes(filtered_dq),
                 file_name="data_quality_issues_filtered.csv",
                 mime="text/csv",
                 use_container_width=True
             )
+            st.download_button(
+                "📥 Download DQ Issues (Parquet)",
+                df_to_parquet_bytes(filtered_dq),
+                file_name="data_quality_issues_filtered.parquet",
+                mime="application/octet-stream",
+                use_container_width=True
+            )
     
     # Display dataframe
     if len(filtered_dq) > 0:
@@ -252,17 +351,22 @@ with tab2:
         top_n = st.number_input("Show top N policies", min_value=10, max_value=500, value=20, step=10, key="top_n_recon")
     
     # Apply reconciliation flag filter
-    filtered_recon = reconciliation.copy()
-    
     if selected_recon_flag != "All":
-        filtered_recon = filtered_recon[filtered_recon["flag_reason"] == selected_recon_flag]
+        filtered_recon = reconciliation.iloc[recon_by_flag.get(selected_recon_flag, np.array([], dtype=np.intp))]
+    else:
+        filtered_recon = reconciliation
     
-    # Add absolute difference column
     if len(filtered_recon) > 0:
-        filtered_recon["abs_diff"] = filtered_recon["diff"].abs()
-        
-        # Sort by absolute difference and get top N
-        top_discrepancies = filtered_recon.nlargest(top_n, "abs_diff")
+        # Partition out the top N by absolute difference instead of sorting every policy;
+        # rows with a missing diff fill any remaining slots in their original order
+        abs_diff = np.abs(filtered_recon["diff"].to_numpy(dtype=float, na_value=np.nan))
+        missing = np.isnan(abs_diff)
+        valid_idx = np.flatnonzero(~missing)
+        k = min(int(top_n), len(valid_idx))
+        top_idx = valid_idx[np.argpartition(-abs_diff[valid_idx], k - 1)[:k]] if k > 0 else valid_idx
+        top_idx = top_idx[np.lexsort((top_idx, -abs_diff[top_idx]))]
+        top_idx = np.concatenate([top_idx, np.flatnonzero(missing)[: int(top_n) - k]])
+        top_discrepancies = filtered_recon.iloc[top_idx].assign(abs_diff=abs_diff[top_idx])
         
         # Display metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -272,13 +376,13 @@ with tab2:
             avg_diff = filtered_recon["diff"].mean()
             st.metric("Avg Difference", f"${avg_diff:,.2f}")
         with col3:
-            max_diff = filtered_recon["abs_diff"].max()
+            max_diff = abs_diff[top_idx[0]]
             st.metric("Max Difference", f"${max_diff:,.2f}")
         with col4:
             # Download button
             st.download_button(
                 "📥 Download",
-                top_discrepancies.to_csv(index=False).encode("utf-8"),
+                df_to_csv_bytes(top_discrepancies),
                 file_name="reconciliation_filtered.csv",
                 mime="text/csv",
                 use_container_width=True
@@ -290,13 +394,14 @@ with tab2:
         # Format and style the dataframe
         display_recon = top_discrepancies[["policy_id", "premium_policy", "premium_gl", "diff", "diff_pct", "flag_reason"]].copy()
         
-        def color_diff(val):
-            if pd.isna(val):
-                return ""
-            color = "green" if val > 0 else "red" if val < 0 else "gray"
-            return f"color: {color}"
+        def color_diff(col):
+            return np.select(
+                [col.isna(), col > 0, col < 0],
+                ["", "color: green", "color: red"],
+                default="color: gray"
+            )
         
-        styled_df = display_recon.style.applymap(color_diff, subset=["diff", "diff_pct"])
+        styled_df = display_recon.style.apply(color_diff, subset=["diff", "diff_pct"])
         st.dataframe(styled_df, use_container_width=True, height=400)
     else:
         st.info("No reconciliation data available.")
@@ -311,7 +416,7 @@ with tab3:
     col_f1, col_f2 = st.columns([3, 1])
     
     with col_f1:
-        available_states = sorted(reporting["state"].dropna().unique()) if len(reporting) > 0 else []
+        available_states = filter_options["state"]
         selected_states = st.multiselect(
             "Filter by State(s)",
             options=available_states,
@@ -324,17 +429,20 @@ with tab3:
         st.write("")  
         
     # Apply state filter
-    filtered_reporting = reporting.copy()
+    reporting_mask = np.ones(len(reporting), dtype=bool)
     if selected_states:
-        filtered_reporting = filtered_reporting[filtered_reporting["state"].isin(selected_states)]
+        reporting_mask &= reporting["state"].isin(selected_states).to_numpy()
+    filtered_reporting = reporting.loc[reporting_mask]
     
     if len(filtered_reporting) > 0:
+        time_series, state_summary = reporting_rollups(reporting, tuple(selected_states))
+        
         # Download button in top right
         col_metrics, col_download = st.columns([3, 1])
         with col_download:
             st.download_button(
                 "📥 Download Trends",
-                filtered_reporting.to_csv(index=False).encode("utf-8"),
+                df_to_csv_bytes(filtered_reporting),
                 file_name="reporting_trends_filtered.csv",
                 mime="text/csv",
                 use_container_width=True
@@ -345,13 +453,7 @@ with tab3:
         # Time series chart
         st.write("**Premium Trends Over Time**")
         
-        # Aggregate by booking date
         if "booking_date" in filtered_reporting.columns:
-            time_series = filtered_reporting.groupby("booking_date").agg({
-                "total_policy_premium": "sum",
-                "total_gl_premium": "sum"
-            }).reset_index()
-            
             # Reshape for line chart
             time_series_melted = time_series.melt(
                 id_vars="booking_date",
@@ -370,12 +472,6 @@ with tab3:
         
         st.write("**Premium by State**")
         
-        # Aggregate by state
-        state_summary = filtered_reporting.groupby("state").agg({
-            "total_policy_premium": "sum",
-            "total_gl_premium": "sum"
-        }).reset_index()
-        
         # Create grouped bar chart using plotly-style data
         import plotly.graph_objects as go
         
@@ -397,14 +493,11 @@ with tab3:
         st.write("**Detailed Reporting Data**")
         
         # Add variance coloring
-        def color_variance(val):
-            if pd.isna(val):
-                return ""
-            color = "green" if val >= 0 else "red"
-            return f"color: {color}"
+        def color_variance(col):
+            return np.where(col.isna(), "", np.where(col >= 0, "color: green", "color: red"))
         
         display_reporting = filtered_reporting[["booking_date", "state", "total_policy_premium", "total_gl_premium", "variance"]].copy()
-        styled_reporting = display_reporting.style.applymap(color_variance, subset=["variance"])
+        styled_reporting = display_reporting.style.apply(color_variance, subset=["variance"])
         st.dataframe(styled_reporting, use_container_width=True, height=300)
     else:
         st.info("No reporting data available for selected filters.")
@@ -420,7 +513,7 @@ with tab4:
     col_f1, col_f2 = st.columns([3, 1])
     
     with col_f1:
-        available_states_claims = sorted(reporting["state"].dropna().unique()) if len(reporting) > 0 else []
+        available_states_claims = filter_options["state"]
         selected_states_claims = st.multiselect(
             "Filter by State(s)",
             options=available_states_claims,
@@ -447,29 +540,19 @@ with tab4:
         
         # Group by state
         if "state" in claims.columns:
-            # Get premium by state from reporting data
-            state_premiums = reporting.groupby("state")["total_policy_premium"].sum().reset_index()
-            
-            # Group claims by state
-            state_claims = claims.groupby("state").agg({
-                "incurred_loss": "sum",
-                "paid_loss": "sum"
-            }).reset_index()
-            
-            # Merge with premiums
-            state_analysis = state_claims.merge(state_premiums, on="state", how="left")
-            state_analysis["loss_ratio"] = (state_analysis["incurred_loss"] / state_analysis["total_policy_premium"]) * 100
+            # Claims and premium by state, computed once per data load
+            state_analysis = loss_ratio_by_state(reporting, claims)
             
             # Apply state filter
             if selected_states_claims:
-                state_analysis = state_analysis[state_analysis["state"].isin(selected_states_claims)]
+                state_analysis = state_analysis.loc[state_analysis["state"].isin(selected_states_claims).to_numpy()]
             
             # Download button
             col_title, col_download = st.columns([3, 1])
             with col_download:
                 st.download_button(
                     "📥 Download Claims",
-                    state_analysis.to_csv(index=False).encode("utf-8"),
+                    df_to_csv_bytes(state_analysis),
                     file_name="claims_analysis_filtered.csv",
                     mime="text/csv",
                     use_container_width=True
@@ -491,14 +574,15 @@ with tab4:
             
             st.write("**Detailed State Analysis**")
             
-            # Format the display
-            display_state = state_analysis_display.copy()
-            display_state["total_policy_premium"] = display_state["total_policy_premium"].apply(lambda x: f"${x:,.2f}")
-            display_state["total_incurred_loss"] = display_state["total_incurred_loss"].apply(lambda x: f"${x:,.2f}")
-            display_state["total_paid_loss"] = display_state["total_paid_loss"].apply(lambda x: f"${x:,.2f}")
-            display_state["loss_ratio"] = display_state["loss_ratio"].apply(lambda x: f"{x:.2f}%")
+            # Format the display (values stay numeric, so columns still sort correctly)
+            styled_state = state_analysis_display.style.format({
+                "total_policy_premium": "${:,.2f}",
+                "total_incurred_loss": "${:,.2f}",
+                "total_paid_loss": "${:,.2f}",
+                "loss_ratio": "{:.2f}%"
+            })
             
-            st.dataframe(display_state, use_container_width=True, height=300)
+            st.dataframe(styled_state, use_container_width=True, height=300)
         else:
             st.dataframe(claims.head(100), use_container_width=True)
     else:
@@ -1,9 +1,189 @@
+import gc
+import hashlib
 import os
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 
+# Failing rows kept per DQ check; the full count is recorded in dq_summary
+DQ_SAMPLE_LIMIT = 1000
+
+# Rows parsed per CSV chunk; bounds peak memory on large inputs
+CHUNK_SIZE = 500_000
+
+SOURCE_FILES = ["data/policies.csv", "data/accounting_gl.csv", "data/claims.csv"]
+
+# Output tables, each written as output/{name}.csv and output/{name}.parquet
+OUTPUT_NAMES = [
+    "dq_summary",
+    "data_quality_issues",
+    "reconciliation_results",
+    "reporting_dataset",
+]
+
+# Fingerprint of the sources and pipeline code the current outputs were built from
+CACHE_KEY_PATH = "output/.cache_key"
+
+# Low-cardinality text columns, stored dictionary-encoded in Parquet outputs
+CATEGORY_COLUMNS = ["state", "table_name", "check_name", "flag_reason"]
+
+
+def source_fingerprint() -> str:
+    """Hash the contents of the source CSVs and of this module.
+
+    Including the module's own source means a change to the checks or
+    reconciliation rules invalidates outputs built by the previous version.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in [*SOURCE_FILES, __file__]:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def outputs_current(fingerprint: str) -> bool:
+    """Return True if every output exists and was built under this fingerprint."""
+    if not all(
+        os.path.exists(f"output/{name}.{ext}")
+        for name in OUTPUT_NAMES
+        for ext in ("csv", "parquet")
+    ):
+        return False
+    try:
+        with open(CACHE_KEY_PATH) as f:
+            return f.read().strip() == fingerprint
+    except FileNotFoundError:
+        return False
+
+
+def save_output(df: pd.DataFrame, name: str) -> None:
+    """Write an output table as CSV for people and Parquet for the dashboard."""
+    df = df.astype({col: "category" for col in CATEGORY_COLUMNS if col in df.columns})
+    df.to_csv(f"output/{name}.csv", index=False)
+    df.to_parquet(f"output/{name}.parquet", engine="pyarrow", compression="snappy", index=False)
+
+
+# (table_name, check_name) -> (failing row count, sample issue frames per chunk)
+DQIssues = dict[tuple[str, str], tuple[int, list[pd.DataFrame]]]
+
+
+def add_issues(
+    dq_issues: DQIssues, df: pd.DataFrame, table_name: str, check_name: str
+) -> None:
+    """Count a check's failing rows and add a capped sample of them as issues.
+
+    Called once per chunk; counts accumulate and the sample cap spans all chunks.
+    """
+    seen, frames = dq_issues.get((table_name, check_name), (0, []))
+    dq_issues[(table_name, check_name)] = (seen + len(df), frames)
+    df = df.head(max(DQ_SAMPLE_LIMIT - seen, 0))
+    frames.append(
+        pd.DataFrame(
+            {
+                "table_name": table_name,
+                "check_name": check_name,
+                "policy_id": df.get("policy_id"),
+                "issue_detail": [str(rec) for rec in df.to_dict(orient="records")],
+            },
+            index=df.index,
+        )
+    )
+
+
+# Each scan streams one source file in chunks, runs its row-level checks per chunk,
+# and keeps only the columns reconciliation and reporting need (null ids never match).
+
+def scan_policies() -> tuple[DQIssues, pd.DataFrame]:
+    """Run the policies checks and return the issues plus id, state and premium."""
+    null_issues: DQIssues = {}
+    policy_parts: list[pd.DataFrame] = []
+    policy_id_count_parts: list[pd.Series] = []
+    for policies in pd.read_csv("data/policies.csv", chunksize=CHUNK_SIZE):
+        policy_id_count_parts.append(
+            policies["policy_id"].value_counts(dropna=False, sort=False)
+        )
+
+        # 2. Nulls in key fields in policies (per chunk, reported after check 1)
+        null_policies = policies[
+            policies["policy_id"].isna() | policies["written_premium"].isna()
+        ]
+        add_issues(null_issues, null_policies, "policies", "null_key_or_premium")
+
+        policy_parts.append(
+            policies.loc[
+                policies["policy_id"].notna(), ["policy_id", "state", "written_premium"]
+            ]
+        )
+
+    # 1. Duplicate policy ids in policies (missing ids count as one group); needs
+    # every chunk's counts, so it runs last but is recorded first
+    dq_issues: DQIssues = {}
+    policy_id_counts = (
+        pd.concat(policy_id_count_parts).groupby(level=0, dropna=False, sort=False).sum()
+    )
+    dup_policies = (
+        policy_id_counts[policy_id_counts > 1]
+        .rename("cnt")
+        .rename_axis("policy_id")
+        .reset_index()
+    )
+    add_issues(dq_issues, dup_policies, "policies", "duplicate_policy_id")
+    dq_issues.update(null_issues)
+
+    return dq_issues, pd.concat(policy_parts, ignore_index=True)
+
+
+def scan_gl() -> tuple[DQIssues, pd.DataFrame]:
+    """Run the GL checks and return the issues plus id, booking date and premium."""
+    dq_issues: DQIssues = {}
+    gl_parts: list[pd.DataFrame] = []
+    for gl in pd.read_csv("data/accounting_gl.csv", chunksize=CHUNK_SIZE):
+        # 3. Nulls in key fields in GL
+        null_gl = gl[gl["policy_id"].isna() | gl["premium_booked"].isna()]
+        add_issues(dq_issues, null_gl, "accounting_gl", "null_key_or_premium")
+
+        # 4. Negative premiums in GL
+        neg_gl = gl[gl["premium_booked"] < 0]
+        add_issues(dq_issues, neg_gl, "accounting_gl", "negative_premium_booked")
+
+        # Normalize booking dates once here; unparseable dates become NaT like SQL DATE()
+        gl_parts.append(
+            gl.loc[
+                gl["policy_id"].notna(), ["policy_id", "booking_date", "premium_booked"]
+            ].assign(
+                booking_date=lambda d: pd.to_datetime(
+                    d["booking_date"], format="%Y-%m-%d", errors="coerce"
+                )
+            )
+        )
+
+    return dq_issues, pd.concat(gl_parts, ignore_index=True)
+
+
+def scan_claims() -> DQIssues:
+    """Run the claims checks and return the issues."""
+    dq_issues: DQIssues = {}
+    for claims in pd.read_csv("data/claims.csv", chunksize=CHUNK_SIZE):
+        # 5. Claims data quality checks
+        claims_null = claims[claims["claim_id"].isna() | claims["policy_id"].isna()]
+        add_issues(dq_issues, claims_null, "claims", "null_claim_or_policy_id")
+
+        claims_incurred_neg = claims[claims["incurred_loss"] < 0]
+        add_issues(dq_issues, claims_incurred_neg, "claims", "negative_incurred_loss")
+
+        claims_paid_gt = claims[claims["paid_loss"] > claims["incurred_loss"]]
+        add_issues(dq_issues, claims_paid_gt, "claims", "paid_greater_than_incurred")
+
+        claims_reserve_mismatch = claims[
+            (claims["reserve"] - (claims["incurred_loss"] - claims["paid_loss"])).abs()
+            > 0.01
+        ]
+        add_issues(dq_issues, claims_reserve_mismatch, "claims", "reserve_mismatch")
+
+    return dq_issues
+
 
 def main() -> None:
     """
@@ -14,214 +194,133 @@ def main() -> None:
       - data/accounting_gl.csv
       - data/claims.csv
 
-    Produces:
-      - output/data_quality_issues.csv
-      - output/reconciliation_results.csv
-      - output/reporting_dataset.csv
+    Produces (each as .csv and .parquet):
+      - output/dq_summary (issue count per table and check)
+      - output/data_quality_issues (up to DQ_SAMPLE_LIMIT sample rows per check)
+      - output/reconciliation_results
+      - output/reporting_dataset
+      - output/.cache_key (fingerprint of the inputs and code, see outputs_current)
+
+    Returns early, without rewriting anything, when the inputs are unchanged since
+    the outputs were built.
     """
     os.makedirs("output", exist_ok=True)
 
-    # Connect to a local SQLite database file
-    # con = sqlite3.connect("obie_finance.db")
-    con = sqlite3.connect(":memory:")
-
-
-    # Load base data
-    policies = pd.read_csv("data/policies.csv")
-    gl = pd.read_csv("data/accounting_gl.csv")
-    claims = pd.read_csv("data/claims.csv")
-
-    # Write to SQLite so we can use SQL
-    policies.to_sql("policies", con, if_exists="replace", index=False)
-    gl.to_sql("accounting_gl", con, if_exists="replace", index=False)
-    claims.to_sql("claims", con, if_exists="replace", index=False)
-
-    dq_issues: list[dict] = []
-
-    def add_issues(df: pd.DataFrame, table_name: str, check_name: str) -> None:
-        """Add each failing row as an issue."""
-        for _, row in df.iterrows():
-            dq_issues.append(
-                {
-                    "table_name": table_name,
-                    "check_name": check_name,
-                    "policy_id": row.get("policy_id"),
-                    "issue_detail": str(dict(row)),
-                }
-            )
-
-    # 1. Duplicate policy ids in policies
-    dup_policies = pd.read_sql_query(
-        """
-        SELECT policy_id, COUNT(*) AS cnt
-        FROM policies
-        GROUP BY policy_id
-        HAVING COUNT(*) > 1
-        """,
-        con,
-    )
-    add_issues(dup_policies, "policies", "duplicate_policy_id")
-
-    # 2. Nulls in key fields in policies
-    null_policies = pd.read_sql_query(
-        """
-        SELECT *
-        FROM policies
-        WHERE policy_id IS NULL OR written_premium IS NULL
-        """,
-        con,
-    )
-    add_issues(null_policies, "policies", "null_key_or_premium")
-
-    # 3. Nulls in key fields in GL
-    null_gl = pd.read_sql_query(
-        """
-        SELECT *
-        FROM accounting_gl
-        WHERE policy_id IS NULL OR premium_booked IS NULL
-        """,
-        con,
-    )
-    add_issues(null_gl, "accounting_gl", "null_key_or_premium")
-
-    # 4. Negative premiums in GL
-    neg_gl = pd.read_sql_query(
-        """
-        SELECT *
-        FROM accounting_gl
-        WHERE premium_booked < 0
-        """,
-        con,
-    )
-    add_issues(neg_gl, "accounting_gl", "negative_premium_booked")
-
-    # 5. Claims data quality checks
-    claims_null = pd.read_sql_query(
-        """
-        SELECT *
-        FROM claims
-        WHERE claim_id IS NULL OR policy_id IS NULL
-        """,
-        con,
-    )
-    add_issues(claims_null, "claims", "null_claim_or_policy_id")
-
-    claims_incurred_neg = pd.read_sql_query(
-        """
-        SELECT *
-        FROM claims
-        WHERE incurred_loss < 0
-        """,
-        con,
-    )
-    add_issues(claims_incurred_neg, "claims", "negative_incurred_loss")
-
-    claims_paid_gt = pd.read_sql_query(
-        """
-        SELECT *
-        FROM claims
-        WHERE paid_loss > incurred_loss
-        """,
-        con,
+    # Hashed once: checked here and recorded with the outputs at the end
+    fingerprint = source_fingerprint()
+    if outputs_current(fingerprint):
+        print("Source data unchanged; existing outputs are current.")
+        return
+
+    # The three files are independent, so scan them concurrently. Each scan owns
+    # its issue accumulators; merging in a fixed order keeps the outputs stable.
+    with ThreadPoolExecutor(max_workers=min(3, os.cpu_count() or 1)) as executor:
+        policies_scan = executor.submit(scan_policies)
+        gl_scan = executor.submit(scan_gl)
+        claims_scan = executor.submit(scan_claims)
+        policy_issues, policy_keys = policies_scan.result()
+        gl_issues, gl_keys = gl_scan.result()
+        claims_issues = claims_scan.result()
+
+    dq_issues: DQIssues = {**policy_issues, **gl_issues, **claims_issues}
+    del policy_issues, gl_issues, claims_issues
+
+    # Create DQ summary and sample DataFrames
+    dq_summary_df = pd.DataFrame(
+        [(table, check, count) for (table, check), (count, _) in dq_issues.items()],
+        columns=["table_name", "check_name", "issue_count"],
     )
-    add_issues(claims_paid_gt, "claims", "paid_greater_than_incurred")
-
-    claims_reserve_mismatch = pd.read_sql_query(
-        """
-        SELECT *
-        FROM claims
-        WHERE ABS(reserve - (incurred_loss - paid_loss)) > 0.01
-        """,
-        con,
+    save_output(dq_summary_df, "dq_summary")
+    dq_df = pd.concat(
+        [frame for _, frames in dq_issues.values() for frame in frames], ignore_index=True
     )
-    add_issues(claims_reserve_mismatch, "claims", "reserve_mismatch")
-
-    # Create DQ issues DataFrame
-    dq_df = pd.DataFrame(dq_issues)
-    dq_df.to_csv("output/data_quality_issues.csv", index=False)
+    save_output(dq_df, "data_quality_issues")
     print(
-        f"Data quality issues saved to output/data_quality_issues.csv. "
-        f"Total issues: {len(dq_df)}"
+        f"Data quality issues saved to output/dq_summary.csv and "
+        f"output/data_quality_issues.csv. "
+        f"Total issues: {dq_summary_df['issue_count'].sum()}"
+    )
+    # Stages run one after another; free each one's frames before the next
+    del dq_df, dq_issues, dq_summary_df
+    gc.collect()
+
+    # Ids are prefixed strings ("P1000", "X2000"), so encode them once as dense int64
+    # codes for the group-bys and joins below. sort=True keeps codes in id order,
+    # and the outputs map codes back to ids.
+    id_codes, policy_ids = pd.factorize(
+        pd.concat([policy_keys["policy_id"], gl_keys["policy_id"]], ignore_index=True),
+        sort=True,
     )
+    n_policy_rows = len(policy_keys)
+    policy_keys = policy_keys.assign(policy_id=id_codes[:n_policy_rows])
+    gl_keys = gl_keys.assign(policy_id=id_codes[n_policy_rows:])
 
     # 6. Reconciliation between policy and GL
-    recon_sql = """
-    WITH policy_premium AS (
-        SELECT policy_id, SUM(written_premium) AS premium_policy
-        FROM policies
-        GROUP BY policy_id
-    ),
-    gl_premium AS (
-        SELECT policy_id, SUM(premium_booked) AS premium_gl
-        FROM accounting_gl
-        GROUP BY policy_id
-    ),
-    all_ids AS (
-        SELECT policy_id FROM policy_premium
-        UNION
-        SELECT policy_id FROM gl_premium
+    # min_count=1 keeps an all-null premium as NaN (SQL SUM semantics) rather than 0;
+    # groups stay unsorted because the outer merge sorts the combined keys once
+    policy_premium = (
+        policy_keys.groupby("policy_id", sort=False)["written_premium"]
+        .sum(min_count=1)
+        .rename("premium_policy")
+    )
+    gl_premium = (
+        gl_keys.groupby("policy_id", sort=False)["premium_booked"]
+        .sum(min_count=1)
+        .rename("premium_gl")
     )
-    SELECT
-        a.policy_id,
-        p.premium_policy,
-        g.premium_gl,
-        (g.premium_gl - p.premium_policy) AS diff
-    FROM all_ids a
-    LEFT JOIN policy_premium p ON a.policy_id = p.policy_id
-    LEFT JOIN gl_premium g ON a.policy_id = g.policy_id
-    """
-
-    recon_df = pd.read_sql_query(recon_sql, con)
 
-    # Drop rows where policy_id is null
-    recon_df = recon_df[recon_df["policy_id"].notna()].copy()
+    # Outer join keeps policies missing from either side
+    recon_df = pd.merge(
+        policy_premium, gl_premium, left_index=True, right_index=True, how="outer"
+    ).reset_index()
+    recon_df["policy_id"] = policy_ids.take(recon_df["policy_id"].to_numpy())
+    recon_df["diff"] = recon_df["premium_gl"] - recon_df["premium_policy"]
 
     # Calculate percentage difference
     recon_df["diff_pct"] = recon_df["diff"] / recon_df["premium_policy"].replace({0: np.nan})
 
-    def flag_reason(row: pd.Series) -> str:
-        if pd.isna(row["premium_policy"]):
-            return "Missing in policies"
-        if pd.isna(row["premium_gl"]):
-            return "Missing in GL"
-        if abs(row["diff"]) > 50:
-            return "Large difference"
-        return "OK"
-
-    recon_df["flag_reason"] = recon_df.apply(flag_reason, axis=1)
+    # Flag each policy; earlier conditions take precedence
+    recon_df["flag_reason"] = np.select(
+        [
+            recon_df["premium_policy"].isna().to_numpy(),
+            recon_df["premium_gl"].isna().to_numpy(),
+            (recon_df["diff"].abs() > 50).to_numpy(),
+        ],
+        ["Missing in policies", "Missing in GL", "Large difference"],
+        default="OK",
+    )
 
-    recon_df.to_csv("output/reconciliation_results.csv", index=False)
+    save_output(recon_df, "reconciliation_results")
     print("Reconciliation results saved to output/reconciliation_results.csv")
+    del recon_df, policy_premium, gl_premium
+    gc.collect()
 
     # 7. Reporting dataset by booking_date and state
-    report_sql = """
-    WITH joined AS (
-        SELECT
-            p.policy_id,
-            p.state,
-            DATE(gl.booking_date) AS booking_date,
-            p.written_premium,
-            gl.premium_booked
-        FROM policies p
-        JOIN accounting_gl gl
-          ON p.policy_id = gl.policy_id
+    # booking_date is already typed, and typed dates survive in Parquet for the dashboard
+    joined = policy_keys.merge(gl_keys, on="policy_id", how="inner")
+
+    report_df = (
+        joined.groupby(["booking_date", "state"], dropna=False)[
+            ["written_premium", "premium_booked"]
+        ]
+        .sum(min_count=1)
+        .rename(
+            columns={
+                "written_premium": "total_policy_premium",
+                "premium_booked": "total_gl_premium",
+            }
+        )
+        .reset_index()
     )
-    SELECT
-        booking_date,
-        state,
-        SUM(written_premium) AS total_policy_premium,
-        SUM(premium_booked) AS total_gl_premium,
-        SUM(premium_booked) - SUM(written_premium) AS variance
-    FROM joined
-    GROUP BY booking_date, state
-    ORDER BY booking_date, state
-    """
-
-    report_df = pd.read_sql_query(report_sql, con)
-    report_df.to_csv("output/reporting_dataset.csv", index=False)
+    del joined, policy_keys, gl_keys
+    report_df["variance"] = report_df["total_gl_premium"] - report_df["total_policy_premium"]
+    save_output(report_df, "reporting_dataset")
     print("Reporting dataset saved to output/reporting_dataset.csv")
 
-    con.close()
+    # Written last, so a failed run never marks its inputs as processed
+    with open(CACHE_KEY_PATH, "w") as f:
+        f.write(fingerprint)
+
     print("All processing complete.")
 
 
@@ -1,172 +1,328 @@
 import os
-import random
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
+# Basic lookup values
+STATES = ["IL", "TX", "FL", "GA", "NC"]
+PRODUCTS = ["Landlord", "Short Term Rental", "Multi-Family"]
+BROKERS = ["Broker A", "Broker B", "Broker C"]
+START_DATE = np.datetime64("2024-01-01", "D")
+
+# Currency columns, rounded to cents and stored as float32 before saving. float32
+# only approximates each cent value (its shortest repr, as written to CSV, is
+# exact), so readers of the Parquet copies widen and re-round to cents before summing
+MONEY_COLUMNS = [
+    "written_premium",
+    "premium_booked",
+    "taxes",
+    "fees",
+    "incurred_loss",
+    "paid_loss",
+]
+
+# Rows converted to Arrow and written per batch; bounds peak memory as N grows
+WRITE_CHUNK_ROWS = 50_000
+
+
+def save_table(df: pd.DataFrame, name: str) -> None:
+    """Write data/{name}.csv with Arrow's native CSV writer plus a Parquet copy.
+
+    The CSVs feed dq_and_reconcile.py; the Parquet files keep dates, floats and
+    categoricals typed for readers that can use them (the dashboard reads claims).
+    Both files are streamed from the frame in WRITE_CHUNK_ROWS batches.
+    """
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+
+    # Dates are held as day-precision datetimes; write them to CSV as YYYY-MM-DD
+    csv_schema = pa.schema(
+        [
+            field.with_type(pa.date32()) if pa.types.is_timestamp(field.type) else field
+            for field in schema
+        ]
+    )
+
+    # The Parquet writer is entered first so it closes last: readers trust a Parquet
+    # copy only when it is at least as new as its CSV
+    with (
+        pq.ParquetWriter(f"data/{name}.parquet", schema, compression="zstd") as parquet_writer,
+        pacsv.CSVWriter(f"data/{name}.csv", csv_schema) as csv_writer,
+    ):
+        for start in range(0, len(df), WRITE_CHUNK_ROWS):
+            chunk = df.iloc[start : start + WRITE_CHUNK_ROWS]
+            batch = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            parquet_writer.write_table(batch)
+            csv_writer.write_table(batch.cast(csv_schema))
+
+
+def inject_claims_bad(
+    claim_ids: np.ndarray,
+    incurred: np.ndarray,
+    paid: np.ndarray,
+    reserve: np.ndarray,
+    bad_idx: np.ndarray,
+    t1: int,
+    t2: int,
+) -> None:
+    """Corrupt the claims rows at bad_idx in place, one bad-row kind per slice.
+
+    Works on plain arrays, so every write is a single positional scatter.
+    """
+    # missing claim_id
+    claim_ids[bad_idx[:t1]] = None
+
+    # paid_loss > incurred_loss (rounded so every stored amount is whole cents)
+    overpay_idx = bad_idx[t1:t2]
+    paid[overpay_idx] = np.round(incurred[overpay_idx] * 1.5, 2)
+
+    # wrong reserve
+    reserve[bad_idx[t2:]] = -1.0
+
+
+def gen_policies(rng: np.random.Generator, policy_ids: np.ndarray) -> pd.DataFrame:
+    """Generate one policy row per id."""
+    num_policies = len(policy_ids)
+
+    # One vectorized draw per column instead of one Python call per row
+    # Day offsets fit in int16
+    eff_offsets = rng.integers(0, 181, num_policies, dtype=np.int16).astype(
+        "timedelta64[D]"
+    )
+
+    # Frames are assembled from finished column arrays; copy=False adopts them as-is
+    return pd.DataFrame(
+        {
+            "policy_id": policy_ids,
+            "effective_date": START_DATE + eff_offsets,
+            "written_premium": rng.uniform(500, 5000, num_policies),
+            # Low-cardinality columns are built as categoricals straight from codes
+            "product": pd.Categorical.from_codes(
+                rng.integers(0, len(PRODUCTS), num_policies), categories=PRODUCTS
+            ),
+            "state": pd.Categorical.from_codes(
+                rng.integers(0, len(STATES), num_policies), categories=STATES
+            ),
+            "broker": pd.Categorical.from_codes(
+                rng.integers(0, len(BROKERS), num_policies), categories=BROKERS
+            ),
+        },
+        copy=False,
+    )
+
+
+def gen_gl_extra(rng: np.random.Generator, num_extra: int) -> dict[str, np.ndarray]:
+    """Generate GL-only rows whose policy ids have no match in the policies system.
+
+    Returned as column arrays, to be concatenated onto the main GL columns.
+    """
+    extra_offsets = rng.integers(0, 181, num_extra, dtype=np.int16).astype("timedelta64[D]")
+    extra_premium = rng.uniform(500, 5000, num_extra)
+
+    return {
+        "policy_id": np.char.add("X", (np.arange(num_extra) + 2000).astype(str)),
+        "booking_date": START_DATE + extra_offsets,
+        "premium_booked": extra_premium,
+        "taxes": extra_premium * 0.05,
+        "fees": rng.uniform(10, 100, num_extra),
+    }
+
+
+def gen_claims(
+    rng: np.random.Generator, policy_ids: np.ndarray
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Generate claims for a sample of policies (state and reserve are added later).
+
+    Also returns each claim's row position in policy_ids, so policy attributes can
+    be gathered by position instead of joined on id.
+    """
+    # Draw each sampled policy's claim count, then generate every claim row in
+    # one shot with the policy positions repeated by count
+    sample_rows = rng.choice(len(policy_ids), 5000, replace=False)
+    counts = rng.integers(0, 4, 5000)
+    claim_rows = np.repeat(sample_rows, counts)
+    total = len(claim_rows)
+
+    loss_offsets = rng.integers(0, 201, total, dtype=np.int16).astype("timedelta64[D]")
+    incurred_loss = rng.uniform(0, 10000, total)
+    # Scale the paid fraction in place rather than allocating a product array
+    paid_loss = rng.uniform(0, 1, total)
+    np.multiply(paid_loss, incurred_loss, out=paid_loss)
+
+    # Claim numbers drawn without replacement, so claim ids never collide. They stay
+    # five digits while the 90,000 numbers from 10000 suffice; larger volumes widen
+    # the range (and the ids) to fit every claim.
+    claim_numbers = rng.choice(max(90000, total), size=total, replace=False) + 10000
+
+    claims = pd.DataFrame(
+        {
+            "claim_id": np.char.add("C", claim_numbers.astype(str)),
+            "policy_id": policy_ids[claim_rows],
+            "loss_date": START_DATE + loss_offsets,
+            "incurred_loss": incurred_loss,
+            "paid_loss": paid_loss,
+        },
+        copy=False,
+    )
+    return claims, claim_rows
+
+
+def main(seed: int | None = None) -> None:
+    """
+    Generate synthetic policies, accounting GL and claims CSVs in the data folder.
+
+    Each section draws from its own Generator, spawned from one SeedSequence so
+    the streams are independent; pass a seed for reproducible data.
+    """
+    rng_policies, rng_gl, rng_gl_extra, rng_claims, rng_dq = [
+        np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(5)
+    ]
 
-def main() -> None:
-    
     # Ensure data folder exists
     os.makedirs("data", exist_ok=True)
 
-    # Basic lookup values
     num_policies = 50000
-    policy_ids = [f"P{1000 + i}" for i in range(num_policies)]
-    states = ["IL", "TX", "FL", "GA", "NC"]
-    products = ["Landlord", "Short Term Rental", "Multi-Family"]
-    brokers = ["Broker A", "Broker B", "Broker C"]
-    start_date = datetime(2024, 1, 1)
+    policy_ids = np.char.add("P", (np.arange(num_policies) + 1000).astype(str))
 
+    # 1. POLICIES, GL-only extras and CLAIMS
     
-    # 1. POLICIES
-    
-    policies_rows = []
-    for pid in policy_ids:
-        eff_date = start_date + timedelta(days=random.randint(0, 180))
-        written_premium = round(np.random.uniform(500, 5000), 2)
-        row = {
-            "policy_id": pid,
-            "effective_date": eff_date.date().isoformat(),
-            "written_premium": written_premium,
-            "product": random.choice(products),
-            "state": random.choice(states),
-            "broker": random.choice(brokers),
-        }
-        policies_rows.append(row)
-
-    policies = pd.DataFrame(policies_rows)
+    # These share no inputs or RNG state, so generate them concurrently (NumPy
+    # releases the GIL in its bulk kernels); each has its own seeded stream, so
+    # the output does not depend on scheduling.
+    with ThreadPoolExecutor(max_workers=min(3, os.cpu_count() or 1)) as executor:
+        policies_job = executor.submit(gen_policies, rng_policies, policy_ids)
+        gl_extra_job = executor.submit(gen_gl_extra, rng_gl_extra, 50)
+        claims_job = executor.submit(gen_claims, rng_claims, policy_ids)
+        policies = policies_job.result()
+        gl_extra = gl_extra_job.result()
+        claims, claim_rows = claims_job.result()
+
+    # Gather each claim's state from its policy's row (stays categorical)
+    claims.insert(2, "state", policies["state"].array.take(claim_rows))
 
 
     # 2. Accounting GL
    
-    gl_rows = []
-    for _, row in policies.iterrows():
-        pid = row["policy_id"]
-        eff_date = datetime.fromisoformat(row["effective_date"])
-        booking_date = eff_date + timedelta(days=random.randint(0, 30))
-
-        # Most are equal, some slightly off (to create recon differences)
-        factor = random.choice([1.0, 1.0, 1.0, 0.95, 1.05])
-        premium_booked = round(row["written_premium"] * factor, 2)
-        taxes = round(premium_booked * 0.05, 2)
-        fees = round(np.random.uniform(10, 100), 2)
-
-        gl_rows.append(
-            {
-                "policy_id": pid,
-                "booking_date": booking_date.date().isoformat(),
-                "premium_booked": premium_booked,
-                "taxes": taxes,
-                "fees": fees,
-            }
-        )
+    written_premium = policies["written_premium"].to_numpy()
+    booking_offsets = rng_gl.integers(0, 31, num_policies, dtype=np.int16).astype(
+        "timedelta64[D]"
+    )
 
-    # Add some GL-only policies (no match in policies system)
-    extra_ids = [f"X{2000 + i}" for i in range(50)]
-    for pid in extra_ids:
-        booking_date = start_date + timedelta(days=random.randint(0, 180))
-        premium_booked = round(np.random.uniform(500, 5000), 2)
-        taxes = round(premium_booked * 0.05, 2)
-        fees = round(np.random.uniform(10, 100), 2)
-
-        gl_rows.append(
-            {
-                "policy_id": pid,
-                "booking_date": booking_date.date().isoformat(),
-                "premium_booked": premium_booked,
-                "taxes": taxes,
-                "fees": fees,
-            }
-        )
+    # Most are equal, some slightly off (to create recon differences)
+    factors = rng_gl.choice([1.0, 0.95, 1.05], num_policies, p=[0.6, 0.2, 0.2])
+    premium_booked = np.multiply(factors, written_premium, out=factors)
 
-    accounting_gl = pd.DataFrame(gl_rows)
+    gl_policies = {
+        "policy_id": policy_ids,
+        "booking_date": policies["effective_date"].to_numpy() + booking_offsets,
+        "premium_booked": premium_booked,
+        "taxes": premium_booked * 0.05,
+        "fees": rng_gl.uniform(10, 100, num_policies),
+    }
 
-    
-    # 3. CLAIMS
-   
-    claims_rows = []
-
-    # Map policy_id -> state so each claim knows its state
-    policy_state_map = dict(zip(policies["policy_id"], policies["state"]))
-
-    # Create claims for a subset of policies
-    for pid in random.sample(policy_ids, 5000):
-        num_claims = random.randint(0, 3)
-        for _ in range(num_claims):
-            loss_date = start_date + timedelta(days=random.randint(0, 200))
-            incurred_loss = round(np.random.uniform(0, 10000), 2)
-            paid_loss = round(incurred_loss * random.uniform(0, 1), 2)
-            reserve = incurred_loss - paid_loss
-
-            claims_rows.append(
-                {
-                    "claim_id": f"C{random.randint(10000, 99999)}",
-                    "policy_id": pid,
-                    "state": policy_state_map.get(pid),
-                    "loss_date": loss_date.date().isoformat(),
-                    "incurred_loss": incurred_loss,
-                    "paid_loss": paid_loss,
-                    "reserve": reserve,
-                }
-            )
+    # Append the GL-only rows column by column and build the frame once
+    accounting_gl = pd.DataFrame(
+        {col: np.concatenate([gl_policies[col], gl_extra[col]]) for col in gl_policies},
+        copy=False,
+    )
 
-    claims = pd.DataFrame(claims_rows)
+    # Amounts are drawn and combined at full precision; quantize them to cents
+    # once, here, rather than after every step, and halve their storage
+    for df in (policies, accounting_gl, claims):
+        money = df.columns.intersection(MONEY_COLUMNS)
+        df[money] = df[money].round(2).astype(np.float32)
+
+    # Reserve comes from the rounded amounts so it is exactly incurred - paid
+    # (rounding again drops float32 subtraction noise; the difference is whole cents).
+    # Subtract and round in one buffer instead of through pandas temporaries.
+    reserve = np.subtract(
+        claims["incurred_loss"].to_numpy(), claims["paid_loss"].to_numpy()
+    )
+    claims["reserve"] = np.round(reserve, 2, out=reserve)
 
    
     # 4. Data quality issues
     
     # Policies: random 3–10% bad rows
-    bad_frac_policies = random.uniform(0.03, 0.10) if len(policies) > 0 else 0.0
+    bad_frac_policies = rng_dq.uniform(0.03, 0.10) if len(policies) > 0 else 0.0
     n_bad_pol = int(bad_frac_policies * len(policies))
     if n_bad_pol > 0:
-        bad_idx_pol = np.random.choice(policies.index, size=n_bad_pol, replace=False)
+        bad_idx_pol = rng_dq.permutation(len(policies))[:n_bad_pol]
         split1 = int(0.5 * n_bad_pol)
 
+        # Scatter into plain arrays by position, then write each column back once
+        premium = policies["written_premium"].to_numpy(copy=True)
+        pids = policies["policy_id"].to_numpy(dtype=object)
+
         # first half: missing written_premium
-        policies.loc[bad_idx_pol[:split1], "written_premium"] = np.nan
+        premium[bad_idx_pol[:split1]] = np.nan
         # second half: missing policy_id
-        policies.loc[bad_idx_pol[split1:], "policy_id"] = None
+        pids[bad_idx_pol[split1:]] = None
+
+        policies["written_premium"] = premium
+        policies["policy_id"] = pids
 
     # GL: random 3–10% bad rows
-    bad_frac_gl = random.uniform(0.03, 0.10) if len(accounting_gl) > 0 else 0.0
+    bad_frac_gl = rng_dq.uniform(0.03, 0.10) if len(accounting_gl) > 0 else 0.0
     n_bad_gl = int(bad_frac_gl * len(accounting_gl))
     if n_bad_gl > 0:
-        bad_idx_gl = np.random.choice(accounting_gl.index, size=n_bad_gl, replace=False)
+        bad_idx_gl = rng_dq.permutation(len(accounting_gl))[:n_bad_gl]
         third = n_bad_gl // 3 if n_bad_gl >= 3 else 1
 
+        pids = accounting_gl["policy_id"].to_numpy(dtype=object)
+        booked = accounting_gl["premium_booked"].to_numpy(copy=True)
+
         # first third: missing policy_id
-        accounting_gl.loc[bad_idx_gl[:third], "policy_id"] = None
+        pids[bad_idx_gl[:third]] = None
         # second third: missing premium_booked
-        accounting_gl.loc[bad_idx_gl[third:2 * third], "premium_booked"] = np.nan
+        booked[bad_idx_gl[third:2 * third]] = np.nan
         # last third: negative premium_booked
         neg_idx = bad_idx_gl[2 * third:]
-        accounting_gl.loc[neg_idx, "premium_booked"] = -accounting_gl.loc[neg_idx, "premium_booked"].abs()
+        booked[neg_idx] = -np.abs(booked[neg_idx])
+
+        accounting_gl["policy_id"] = pids
+        accounting_gl["premium_booked"] = booked
 
     # Claims: random 3–10% bad rows
-    bad_frac_claims = random.uniform(0.03, 0.10) if len(claims) > 0 else 0.0
+    bad_frac_claims = rng_dq.uniform(0.03, 0.10) if len(claims) > 0 else 0.0
     n_bad_cl = int(bad_frac_claims * len(claims))
     if n_bad_cl > 0:
-        bad_idx_cl = np.random.choice(claims.index, size=n_bad_cl, replace=False)
+        bad_idx_cl = rng_dq.permutation(len(claims))[:n_bad_cl]
         third_cl = n_bad_cl // 3 if n_bad_cl >= 3 else 1
 
-        # missing claim_id
-        claims.loc[bad_idx_cl[:third_cl], "claim_id"] = None
+        claim_ids = claims["claim_id"].to_numpy(dtype=object)
+        paid = claims["paid_loss"].to_numpy(copy=True)
+        reserve = claims["reserve"].to_numpy(copy=True)
 
-        # paid_loss > incurred_loss
-        overpay_idx = bad_idx_cl[third_cl:2 * third_cl]
-        claims.loc[overpay_idx, "paid_loss"] = claims.loc[overpay_idx, "incurred_loss"] * 1.5
+        inject_claims_bad(
+            claim_ids,
+            claims["incurred_loss"].to_numpy(),
+            paid,
+            reserve,
+            bad_idx_cl,
+            third_cl,
+            2 * third_cl,
+        )
 
-        # wrong reserve
-        claims.loc[bad_idx_cl[2 * third_cl:], "reserve"] = -1.0
+        claims["claim_id"] = claim_ids
+        claims["paid_loss"] = paid
+        claims["reserve"] = reserve
 
     
-    # 5. SAVE CSVs
+    # 5. SAVE CSVs (and Parquet copies)
     
-    policies.to_csv("data/policies.csv", index=False)
-    accounting_gl.to_csv("data/accounting_gl.csv", index=False)
-    claims.to_csv("data/claims.csv", index=False)
+    # The three files are independent and Arrow writes without holding the GIL
+    with ThreadPoolExecutor(max_workers=min(3, os.cpu_count() or 1)) as executor:
+        list(
+            executor.map(
+                save_table,
+                [policies, accounting_gl, claims],
+                ["policies", "accounting_gl", "claims"],
+            )
+        )
 
     print("Synthetic data created in the 'data' folder.")
     print(